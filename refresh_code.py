@@ -4,25 +4,79 @@ Live Room Code Refresh Script
 自动获取直播间列表，按名称过滤后刷新验证码，并汇总推送到企业微信。
 """
 
-from dataclasses import dataclass
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+import functools
+import hashlib
+import logging
 import os
+import queue
+import re
+import socket
+import sys
+import threading
+import time
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import connection as urllib3_connection
+from urllib3.util.retry import Retry
 
 
+logger = logging.getLogger(__name__)
+
 LIVE_LIST_PAYLOAD = {
     "pageInfo": {"orderBy": "", "pageNum": 1, "pageSize": 1000, "total": 100, "pages": 10},
     "param": {},
 }
 
+# 请求体固定不变，模块加载时序列化一次，所有服务器复用
+LIVE_LIST_BODY = orjson.dumps(LIVE_LIST_PAYLOAD)
+
+# 各服务器接口路径，在初始化时展开为完整 URL
+LIVE_API_PATHS = {
+    "list": "liveList",
+    "refresh": "refreshVerifyCode",
+    "batch": "batchRefVerifyCode",
+}
+
+# 企业微信机器人 markdown 消息内容上限（字节）
+WEBHOOK_MARKDOWN_MAX_BYTES = 4096
+
+# 企业微信机器人接口地址，单独挂载不重试已送达请求的连接适配器
+WEBHOOK_BASE_URL = "https://qyapi.weixin.qq.com/"
+
+# 企业微信消息体只有 content 会变化，外层结构预先编码好，发送时直接拼接
+WEBHOOK_BODY_PREFIX = {
+    "text": b'{"msgtype":"text","text":{"content":',
+    "markdown": b'{"msgtype":"markdown","markdown":{"content":',
+}
+WEBHOOK_BODY_SUFFIX = b"}}"
+
+# 同时发往业务服务器的请求数上限（可用 MAX_CONCURRENCY 覆盖），以及同时发往企业微信的请求数上限
+DEFAULT_MAX_CONCURRENCY = 8
+WEBHOOK_MAX_CONCURRENCY = 2
 
-@dataclass
+# 逐个服务器推送通知时的最大并发数
+NOTIFY_MAX_WORKERS = 8
+
+# DNS 解析结果缓存时间（秒）
+DNS_CACHE_TTL = 300
+
+# 上次推送结果的指纹，结果未变化时跳过推送
+DEFAULT_STATE_PATH = "~/.live-task.state"
+
+
+@dataclass(slots=True, frozen=True)
 class ServerConfig:
     alias: str
     url: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class LiveRoomResult:
     name: str
     code: str
@@ -30,44 +84,194 @@ class LiveRoomResult:
     message: str = ""
 
 
+@dataclass(slots=True)
+class ServerResult:
+    alias: str
+    rooms: List[LiveRoomResult] = field(default_factory=list)
+    success: bool = False
+    error: Optional[str] = None
+    # 获取直播列表被服务端拒绝（meta.success=false 或 401/403），可能是 token 已过期
+    list_rejected: bool = False
+
+
+_dns_cache: Dict[str, tuple[float, tuple[str, ...]]] = {}
+_dns_lock = threading.Lock()
+_urllib3_create_connection = urllib3_connection.create_connection
+
+
+def _create_connection_with_dns_cache(address, *args, **kwargs):
+    """缓存主机的全部 IPv4 解析结果：并发建连和重复请求同一主机时不再重复解析，也避开 IPv6 不通时的等待"""
+    host, port = address
+    now = time.monotonic()
+    with _dns_lock:
+        cached = _dns_cache.get(host)
+    if cached and cached[0] > now:
+        ips = cached[1]
+    else:
+        try:
+            infos = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)
+        except socket.gaierror:
+            # 没有 IPv4 地址时交回 urllib3 按默认方式解析
+            return _urllib3_create_connection(address, *args, **kwargs)
+        ips = tuple(dict.fromkeys(info[4][0] for info in infos))
+        with _dns_lock:
+            _dns_cache[host] = (now + DNS_CACHE_TTL, ips)
+
+    # 与 urllib3 自身行为一致：依次尝试每条 A 记录，全部失败才报错
+    error: Optional[OSError] = None
+    for ip in ips:
+        try:
+            return _urllib3_create_connection((ip, port), *args, **kwargs)
+        except OSError as exc:
+            error = exc
+    with _dns_lock:
+        _dns_cache.pop(host, None)
+    raise error or OSError(f"无法解析主机 {host}")
+
+
+def install_dns_cache() -> None:
+    """为本进程的 urllib3 连接启用 DNS 缓存（进程级替换，可重复调用）；作为库引入时按需自行开启"""
+    # TLS 的 SNI 和证书校验使用连接对象上的主机名，这里只替换实际拨号的地址
+    urllib3_connection.create_connection = _create_connection_with_dns_cache
+
+
+def _as_dict(value: object) -> Dict:
+    """接口字段在失败时可能是 null 或字符串，统一按空字典读取"""
+    return value if isinstance(value, dict) else {}
+
+
+def _webhook_body(msgtype: str, content: str) -> bytes:
+    return WEBHOOK_BODY_PREFIX[msgtype] + orjson.dumps(content) + WEBHOOK_BODY_SUFFIX
+
+
+def _compile_targets(targets: List[str]) -> "re.Pattern[str]":
+    return re.compile("|".join(re.escape(target) for target in targets))
+
+
 class LiveCodeRefresher:
     """按服务器批量刷新直播间验证码，并聚合推送"""
 
-    def __init__(self, servers: List[ServerConfig], live_names: List[str], webhook_key: str):
+    def __init__(
+        self,
+        servers: Sequence[ServerConfig],
+        live_names: Sequence[str],
+        webhook_key: str,
+        state_path: str = DEFAULT_STATE_PATH,
+        batch_mode: bool = False,
+        max_concurrency: Optional[int] = None,
+    ):
         self.servers = servers
+        # 开启后每个服务器的所有分组合并为一次批量刷码，各分组将得到同一个验证码
+        self.batch_mode = batch_mode
         self.token = ""  # 通过 login 方法设置
+        # 以 ServerConfig 本身为键（frozen，可哈希），别名重复时各服务器仍指向自己的地址
+        self._endpoints: Dict[ServerConfig, Dict[str, str]] = {
+            server: {key: f"https://{server.url}/api/live/{path}" for key, path in LIVE_API_PATHS.items()}
+            for server in servers
+        }
         self.live_names = live_names
-        self.webhook_url = f"https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key={webhook_key}"
+        self.webhook_url = f"{WEBHOOK_BASE_URL}cgi-bin/webhook/send?key={webhook_key}"
+        self.state_path = Path(state_path).expanduser()
+        # 服务器和分组两级并发叠加后请求数会成倍增长，用信号量限制同时在途的请求，避免触发后端限流
+        if max_concurrency is None:
+            max_concurrency = _parse_positive_int("MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+        elif max_concurrency < 1:
+            raise ValueError("max_concurrency 必须为正整数")
+        self._request_slots = threading.BoundedSemaphore(max_concurrency)
+        self._webhook_slots = threading.BoundedSemaphore(WEBHOOK_MAX_CONCURRENCY)
         self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        # 每个服务器和登录服务器各占一个连接池，复用 keep-alive 连接避免重复握手；
+        # 连接失败和网关类 5xx 在连接层退避重试，避免一次网络抖动浪费整轮刷新
+        adapter = HTTPAdapter(
+            pool_connections=len(servers) + 1,
+            # 同一服务器上各分组并发刷码，池容量不小于并发数，保证每条 keep-alive 连接都能放回复用
+            pool_maxsize=max(NOTIFY_MAX_WORKERS, len(live_names)),
+            max_retries=Retry(
+                total=3,
+                connect=3,
+                read=3,
+                backoff_factor=0.5,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(["POST"]),  # 所有接口都是 POST，默认配置不会重试
+                raise_on_status=False,  # 重试耗尽后交给 _post_json 按原始状态码报错
+            ),
+        )
+        self.session.mount("https://", adapter)
+        # 企业微信可能已收到消息后才读超时或返回 5xx，重试会重复推送；只重试请求未送达的连接失败
+        webhook_adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=NOTIFY_MAX_WORKERS,
+            max_retries=Retry(
+                total=3,
+                connect=3,
+                read=0,
+                status=0,
+                other=0,
+                backoff_factor=0.5,
+                allowed_methods=frozenset(["POST"]),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount(WEBHOOK_BASE_URL, webhook_adapter)
 
     # ----------------- 请求封装 -----------------
-    def _headers(self) -> Dict[str, str]:
-        return {"Content-Type": "application/json", "Token": self.token}
+    @property
+    def token(self) -> str:
+        return self._token
+
+    @token.setter
+    def token(self, value: str) -> None:
+        # token 只在登录后变化，缓存请求头避免每次请求重新构造；不放入 session 公共头，以免发往企业微信
+        self._token = value
+        self._auth_headers = {"Token": value}
+
+    def _post_json(self, endpoint: str, body: bytes, headers: Optional[Dict[str, str]] = None, timeout: int = 15) -> Dict:
+        """发送请求并直接从响应原始字节解析 JSON，省去 response.json() 先解码为 str 的一次拷贝
+
+        4xx 响应体里的 meta.message 比 HTTP 状态更有用，只对 5xx 或无法解析的非 2xx 响应按状态码报错，
+        其余交给调用方的业务成功标志判断。
+        """
+        slots = self._webhook_slots if endpoint == self.webhook_url else self._request_slots
+        with slots:
+            response = self.session.post(endpoint, data=body, headers=headers, timeout=timeout)
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+        try:
+            data = orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            data = None
+        if response.ok:
+            if isinstance(data, dict):
+                return data
+            raise ValueError("响应数据格式异常")
+        # 非 2xx 只有带 meta 的业务响应才交给调用方；网关等返回的其他内容以状态码为准
+        if isinstance(data, dict) and isinstance(data.get("meta"), dict):
+            return data
+        raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
 
     def login(self, login_url: str, user_id: str, password: str) -> str:
         """调用登录接口获取 token"""
         endpoint = f"https://{login_url}/api/auth/loginAdmin"
         payload = {"param": {"password": password, "userId": user_id}}
-        response = self.session.post(endpoint, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
-        response.raise_for_status()
-        data = response.json()
+        data = self._post_json(endpoint, orjson.dumps(payload))
 
-        if not data.get("meta", {}).get("success"):
-            raise ValueError(data.get("meta", {}).get("message", "登录失败"))
+        meta = _as_dict(data.get("meta"))
+        if not meta.get("success"):
+            raise ValueError(meta.get("message") or "登录失败")
 
-        token = data.get("data", {}).get("token")
+        token = _as_dict(data.get("data")).get("token")
         if not token:
             raise ValueError("登录响应中未找到 token")
         return token
 
     def fetch_live_list(self, server: ServerConfig) -> List[Dict]:
-        endpoint = f"https://{server.url}/api/live/liveList"
-        response = self.session.post(endpoint, json=LIVE_LIST_PAYLOAD, headers=self._headers(), timeout=15)
-        response.raise_for_status()
-        data = response.json()
+        endpoint = self._endpoints[server]["list"]
+        data = self._post_json(endpoint, LIVE_LIST_BODY, self._auth_headers)
 
-        if not data.get("meta", {}).get("success"):
-            raise ValueError(data.get("meta", {}).get("message", "获取直播列表失败"))
+        meta = _as_dict(data.get("meta"))
+        if not meta.get("success"):
+            raise ValueError(meta.get("message") or "获取直播列表失败")
 
         live_list = data.get("data", [])
         if not isinstance(live_list, list):
@@ -75,24 +279,22 @@ class LiveCodeRefresher:
         return live_list
 
     def refresh_room_code(self, server: ServerConfig, live_id: str) -> LiveRoomResult:
-        endpoint = f"https://{server.url}/api/live/refreshVerifyCode"
-        response = self.session.post(endpoint, json={"param": live_id}, headers=self._headers(), timeout=15)
-        response.raise_for_status()
-        data = response.json()
+        endpoint = self._endpoints[server]["refresh"]
+        data = self._post_json(endpoint, orjson.dumps({"param": live_id}), self._auth_headers)
 
-        success = bool(data.get("meta", {}).get("success"))
-        code = data.get("data", {}).get("code") or data.get("meta", {}).get("message", "刷新失败")
+        meta = _as_dict(data.get("meta"))
+        success = bool(meta.get("success"))
+        code = _as_dict(data.get("data")).get("code") or meta.get("message") or "刷新失败"
         return LiveRoomResult(name="", code=str(code), success=success, message="" if success else str(code))
 
     def refresh_multi_room_code(self, server: ServerConfig, live_ids: List[str]) -> LiveRoomResult:
-        endpoint = f"https://{server.url}/api/live/batchRefVerifyCode"
-        response = self.session.post(endpoint, json={"param": ",".join(live_ids)}, headers=self._headers(), timeout=15)
-        response.raise_for_status()
-        data = response.json()
+        endpoint = self._endpoints[server]["batch"]
+        data = self._post_json(endpoint, orjson.dumps({"param": ",".join(live_ids)}), self._auth_headers)
 
-        success = bool(data.get("meta", {}).get("success"))
+        meta = _as_dict(data.get("meta"))
+        success = bool(meta.get("success"))
         # 响应格式: data 直接是验证码字符串，如 "3200"
-        code = data.get("data") or data.get("meta", {}).get("message", "刷新失败")
+        code = data.get("data") or meta.get("message") or "刷新失败"
         return LiveRoomResult(name="", code=str(code), success=success, message="" if success else str(code))
 
     # ----------------- 业务逻辑 -----------------
@@ -100,143 +302,297 @@ class LiveCodeRefresher:
         """解析 live_names，支持 | 分隔的多房间组"""
         return [[n.strip() for n in item.split("|") if n.strip()] for item in self.live_names if item]
 
-    def filter_live_rooms(self, live_list: List[Dict]) -> List[Dict]:
+    def filter_live_rooms(self, live_list: Iterable[Dict]) -> List[Dict]:
         """根据名称组匹配直播间，返回分组结构 [{"names": [...], "rooms": [...]}]"""
         groups = self._parse_live_name_groups()
+        # 单次遍历直播列表，记录每个目标名首个匹配的房间；全部目标命中后提前结束
+        pending = list(dict.fromkeys(target for name_group in groups for target in name_group))
+        # 所有待匹配目标合成一个正则，一次 C 层扫描即可排除不含任何目标的房间名
+        pattern = _compile_targets(pending)
+        matched: Dict[str, Dict] = {}
+        for room in live_list:
+            if not pending:
+                break
+            room_name = str(room.get("name", ""))
+            if not room_name or not pattern.search(room_name):
+                continue
+            hits = [target for target in pending if target in room_name]
+            if hits:
+                for target in hits:
+                    matched[target] = room
+                pending = [target for target in pending if target not in matched]
+                pattern = _compile_targets(pending)
+
         result = []
         for name_group in groups:
-            rooms = []
-            for target in name_group:
-                for room in live_list:
-                    room_name = str(room.get("name", ""))
-                    if room_name and target in room_name:
-                        rooms.append(room)
-                        break
+            rooms = [matched[target] for target in name_group if target in matched]
             if rooms:
                 result.append({"names": name_group, "rooms": rooms})
         return result
 
-    def refresh_server(self, server: ServerConfig) -> Dict:
-        print(f"正在处理服务器 [{server.alias}] ...")
-        result: Dict = {"alias": server.alias, "rooms": [], "success": False, "error": None}
+    def _refresh_group(self, server: ServerConfig, group: Dict) -> LiveRoomResult:
+        display_name = "|".join(group["names"])
+        live_ids = [str(room.get("id")) for room in group["rooms"] if room.get("id")]
 
+        if not live_ids:
+            msg = "缺少直播间 ID，无法刷码"
+            return LiveRoomResult(name=display_name, code=msg, success=False, message=msg)
+
+        try:
+            if len(live_ids) == 1:
+                refresh_result = self.refresh_room_code(server, live_ids[0])
+            else:
+                refresh_result = self.refresh_multi_room_code(server, live_ids)
+            refresh_result = replace(refresh_result, name=display_name)
+            if refresh_result.success:
+                logger.debug("[%s] %s 刷码成功", server.alias, display_name)
+            else:
+                logger.error("[%s] %s 刷码失败：%s", server.alias, display_name, refresh_result.message)
+            return refresh_result
+        except (requests.RequestException, ValueError) as exc:
+            message = f"刷码异常：{exc}"
+            logger.error("[%s] %s %s", server.alias, display_name, message)
+            return LiveRoomResult(name=display_name, code=message, success=False, message=message)
+
+    def _refresh_groups_batched(self, server: ServerConfig, matched_groups: List[Dict]) -> List[LiveRoomResult]:
+        """所有分组的直播间合并为一次 batchRefVerifyCode 调用，返回的验证码归属到每个分组"""
+        group_ids = [[str(room.get("id")) for room in group["rooms"] if room.get("id")] for group in matched_groups]
+        all_ids = list(dict.fromkeys(live_id for live_ids in group_ids for live_id in live_ids))
+        if len(all_ids) < 2:
+            return [self._refresh_group(server, group) for group in matched_groups]
+
+        display_name = "|".join(name for group in matched_groups for name in group["names"])
         try:
-            live_list = self.fetch_live_list(server)
-        except Exception as exc:  # noqa: BLE001 - 需要捕获所有异常用于反馈
-            result["error"] = f"获取直播列表失败：{exc}"
-            print(f"[{server.alias}] {result['error']}")
+            batch_result = self.refresh_multi_room_code(server, all_ids)
+            if batch_result.success:
+                logger.debug("[%s] %s 批量刷码成功", server.alias, display_name)
+            else:
+                logger.error("[%s] %s 批量刷码失败：%s", server.alias, display_name, batch_result.message)
+        except (requests.RequestException, ValueError) as exc:
+            message = f"刷码异常：{exc}"
+            logger.error("[%s] %s %s", server.alias, display_name, message)
+            batch_result = LiveRoomResult(name="", code=message, success=False, message=message)
+
+        rooms = []
+        for group, live_ids in zip(matched_groups, group_ids):
+            name = "|".join(group["names"])
+            if live_ids:
+                rooms.append(replace(batch_result, name=name))
+            else:
+                msg = "缺少直播间 ID，无法刷码"
+                rooms.append(LiveRoomResult(name=name, code=msg, success=False, message=msg))
+        return rooms
+
+    def refresh_server(self, server: ServerConfig) -> ServerResult:
+        logger.debug("正在处理服务器 [%s] ...", server.alias)
+        result = ServerResult(alias=server.alias)
+
+        try:
+            # 直播列表只在过滤时使用，不保存引用，刷码请求等待期间只保留匹配到的房间
+            matched_groups = self.filter_live_rooms(self.fetch_live_list(server))
+        except (requests.RequestException, ValueError) as exc:
+            result.error = f"获取直播列表失败：{exc}"
+            result.list_rejected = isinstance(exc, ValueError) or (
+                isinstance(exc, requests.HTTPError)
+                and exc.response is not None
+                and exc.response.status_code in (401, 403)
+            )
+            logger.error("[%s] %s", server.alias, result.error)
             return result
 
-        matched_groups = self.filter_live_rooms(live_list)
         if not matched_groups:
-            result["error"] = "未匹配到任何需要刷码的直播间"
-            print(f"[{server.alias}] {result['error']}")
+            result.error = "未匹配到任何需要刷码的直播间"
+            logger.error("[%s] %s", server.alias, result.error)
             return result
 
-        for group in matched_groups:
-            display_name = "|".join(group["names"])
-            live_ids = [str(room.get("id")) for room in group["rooms"] if room.get("id")]
-
-            if not live_ids:
-                msg = "缺少直播间 ID，无法刷码"
-                result["rooms"].append(LiveRoomResult(name=display_name, code=msg, success=False, message=msg))
-                continue
+        if self.batch_mode:
+            result.rooms = self._refresh_groups_batched(server, matched_groups)
+        else:
+            # 各分组的刷码请求互不依赖，并发发出
+            with ThreadPoolExecutor(max_workers=len(matched_groups)) as executor:
+                result.rooms = list(executor.map(lambda group: self._refresh_group(server, group), matched_groups))
 
-            try:
-                if len(live_ids) == 1:
-                    refresh_result = self.refresh_room_code(server, live_ids[0])
-                else:
-                    refresh_result = self.refresh_multi_room_code(server, live_ids)
-                refresh_result.name = display_name
-                result["rooms"].append(refresh_result)
-                status = "成功" if refresh_result.success else f"失败：{refresh_result.message}"
-                print(f"[{server.alias}] {display_name} 刷码{status}")
-            except Exception as exc:  # noqa: BLE001
-                message = f"刷码异常：{exc}"
-                print(f"[{server.alias}] {display_name} {message}")
-                result["rooms"].append(LiveRoomResult(name=display_name, code=message, success=False, message=message))
-
-        result["success"] = bool(result["rooms"]) and all(room.success for room in result["rooms"])
+        result.success = bool(result.rooms) and all(room.success for room in result.rooms)
         return result
 
-    def refresh_all(self) -> List[Dict]:
-        return [self.refresh_server(server) for server in self.servers]
+    def refresh_all(self) -> List[ServerResult]:
+        """并发刷新所有服务器，总耗时取决于最慢的服务器而非各服务器之和"""
+        if not self.servers:
+            return []
+        with ThreadPoolExecutor(max_workers=len(self.servers)) as executor:
+            return list(executor.map(self.refresh_server, self.servers))
 
     # ----------------- 推送 -----------------
-    def build_message(self, server_result: Dict) -> str:
-        alias = server_result.get("alias", "unknown")
+    def build_message(self, server_result: ServerResult) -> str:
+        alias = server_result.alias
 
-        if server_result.get("error"):
-            return f"【{alias}】刷码失败\n原因：{server_result['error']}"
+        if server_result.error:
+            return f"【{alias}】刷码失败\n原因：{server_result.error}"
 
-        all_success = server_result.get("success", False)
-        header = "刷码成功" if all_success else "刷码完成（部分失败）"
-        lines = [f"【{alias}】{header}"]
-
-        rooms: List[LiveRoomResult] = server_result.get("rooms", [])
+        header = "刷码成功" if server_result.success else "刷码完成（部分失败）"
+        rooms = server_result.rooms
         if not rooms:
-            lines.append("未匹配到需要刷码的直播间")
-        else:
-            for room in rooms:
-                if room.success:
-                    lines.append(f"{room.name}:{room.code}")
-                else:
-                    lines.append(f"{room.name} 刷码失败：{room.message}")
+            return f"【{alias}】{header}\n未匹配到需要刷码的直播间"
 
-        return "\n".join(lines)
+        return "\n".join(
+            [
+                f"【{alias}】{header}",
+                *(f"{room.name}:{room.code}" if room.success else f"{room.name} 刷码失败：{room.message}" for room in rooms),
+            ]
+        )
 
-    def send_notification(self, server_result: Dict) -> bool:
-        payload = {"msgtype": "text", "text": {"content": self.build_message(server_result)}}
+    def build_aggregate_message(self, results: List[ServerResult]) -> str:
+        """将所有服务器的结果合并为一条消息"""
+        return "\n---\n".join(self.build_message(result) for result in results)
 
+    def _post_webhook(self, body: bytes, label: str) -> bool:
         try:
-            response = self.session.post(self.webhook_url, json=payload, timeout=10)
-            response.raise_for_status()
-            result = response.json()
+            result = self._post_json(self.webhook_url, body, timeout=10)
 
             if result.get("errcode") == 0:
-                print(f"[{server_result.get('alias', 'unknown')}] 通知发送成功")
+                logger.info("[%s] 通知发送成功", label)
                 return True
-            print(f"[{server_result.get('alias', 'unknown')}] 通知发送失败: {result.get('errmsg', '未知错误')}")
-        except Exception as exc:  # noqa: BLE001
-            print(f"[{server_result.get('alias', 'unknown')}] 发送通知异常: {exc}")
+            logger.error("[%s] 通知发送失败: %s", label, result.get("errmsg", "未知错误"))
+        except (requests.RequestException, ValueError) as exc:
+            logger.error("[%s] 发送通知异常: %s", label, exc)
 
         return False
 
-    def run(self) -> None:
-        print("=" * 60)
-        print("开始刷新直播间验证码...")
-        print("=" * 60)
+    def send_notification(self, server_result: ServerResult) -> bool:
+        return self._post_webhook(_webhook_body("text", self.build_message(server_result)), server_result.alias)
 
-        results = self.refresh_all()
-        if not results:
-            print("没有可刷新的服务器")
-            return
+    def send_aggregate_notification(self, results: List[ServerResult]) -> bool:
+        """汇总推送一条 markdown 消息；超出企业微信长度限制时退回逐个服务器推送"""
+        content = self.build_aggregate_message(results)
+        if len(content.encode("utf-8")) > WEBHOOK_MARKDOWN_MAX_BYTES:
+            logger.info("汇总消息超出长度限制，改为按服务器分别推送")
+            # 各服务器的通知互相独立，并发推送；requests.Session 的连接池可在线程间共享
+            with ThreadPoolExecutor(max_workers=min(NOTIFY_MAX_WORKERS, len(results))) as executor:
+                return all(list(executor.map(self.send_notification, results)))
+
+        return self._post_webhook(_webhook_body("markdown", content), "汇总")
+
+    def notify_login_failure(self, user_id: str, exc: Exception) -> bool:
+        error_msg = f"刷码失败：账号 {user_id} 登录失败 - {exc}"
+        logger.error("%s", error_msg)
+        return self._post_webhook(_webhook_body("text", error_msg), "登录")
+
+    # ----------------- 去重 -----------------
+    def _fingerprint(self, results: List[ServerResult]) -> str:
+        return hashlib.blake2b(orjson.dumps(results, option=orjson.OPT_SORT_KEYS)).hexdigest()
 
-        print("\n" + "=" * 60)
-        print("刷新完成，开始推送...")
-        print("=" * 60)
+    def _read_last_fingerprint(self) -> str:
+        try:
+            return self.state_path.read_text(encoding="utf-8").strip()
+        except OSError:
+            return ""
 
-        for result in results:
-            self.send_notification(result)
+    def _save_fingerprint(self, fingerprint: str) -> None:
+        try:
+            self.state_path.write_text(fingerprint, encoding="utf-8")
+        except OSError as exc:
+            logger.error("保存推送状态失败: %s", exc)
 
+    def run(self) -> List[ServerResult]:
+        logger.info("=" * 60)
+        logger.info("开始刷新直播间验证码...")
+        logger.info("=" * 60)
 
-def _parse_list(env_key: str) -> List[str]:
+        results = self.refresh_all()
+        if not results:
+            logger.info("没有可刷新的服务器")
+            return results
+
+        fingerprint = self._fingerprint(results)
+        if fingerprint == self._read_last_fingerprint():
+            logger.info("刷新结果与上次推送一致，跳过推送")
+            return results
+
+        logger.info("\n" + "=" * 60)
+        logger.info("刷新完成，开始推送...")
+        logger.info("=" * 60)
+
+        # 推送成功后才记录指纹，失败时下次仍会重试推送
+        if self.send_aggregate_notification(results):
+            self._save_fingerprint(fingerprint)
+        return results
+
+    def run_forever(
+        self,
+        interval: float,
+        login_url: str,
+        user_id: str,
+        password: str,
+        stop_event: Optional[threading.Event] = None,
+    ) -> None:
+        """常驻模式：按固定间隔重复 run()，session 连接池在各轮之间复用
+
+        DNS 缓存和日志输出不会自动开启：需要时调用方自行调用 install_dns_cache()，并为 logger 配置 handler。
+
+        token 过期时获取直播列表只返回 meta.success=false，因此尚未登录或上一轮有服务器列表被拒绝时，
+        下一轮开始前重新登录；房间匹配或刷码失败不会触发重新登录。
+        设置 stop_event 可在下一轮开始前退出。
+        """
+        stop_event = stop_event or threading.Event()
+        relogin = not self.token
+        login_failure_notified = False
+        while not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                if relogin:
+                    try:
+                        self.token = self.login(login_url, user_id, password)
+                        relogin = False
+                        login_failure_notified = False
+                    except (requests.RequestException, ValueError) as exc:
+                        # 持续登录失败时只推送一次，避免每轮重复通知
+                        if login_failure_notified:
+                            logger.error("重新登录失败: %s", exc)
+                        else:
+                            login_failure_notified = self.notify_login_failure(user_id, exc)
+
+                if not relogin:
+                    results = self.run()
+                    relogin = any(result.list_rejected for result in results)
+            except Exception:  # noqa: BLE001 - 常驻模式下单轮异常不能终止循环
+                logger.exception("本轮刷新异常")
+                relogin = True
+            # 按开始时间对齐间隔，避免每轮耗时累积造成漂移
+            stop_event.wait(max(0.0, interval - (time.monotonic() - started)))
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_list(env_key: str) -> tuple[str, ...]:
     raw = os.getenv(env_key, "")
-    items = [item.strip() for item in raw.split(",") if item.strip()]
+    items = tuple(item.strip() for item in raw.split(",") if item.strip())
     if not items:
         raise ValueError(f"{env_key} 未配置")
     return items
 
 
-def load_config_from_env() -> tuple[List[ServerConfig], str, str, str, List[str], str]:
-    """从环境变量读取配置"""
+def _parse_positive_int(env_key: str, default: int) -> int:
+    raw = os.getenv(env_key, "").strip()
+    if not raw:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise ValueError(f"{env_key} 必须为正整数")
+    return value
+
+
+@functools.cache
+def load_config_from_env() -> tuple[tuple[ServerConfig, ...], str, str, str, tuple[str, ...], str]:
+    """从环境变量读取配置，进程内只解析一次；环境变量变化后调用 reload_config() 重新读取"""
 
     aliases = _parse_list("SERVER_ALIAS_LIST")
     urls = _parse_list("SERVER_URL_LIST")
     if len(aliases) != len(urls):
         raise ValueError("SERVER_ALIAS_LIST 与 SERVER_URL_LIST 数量不一致")
 
-    servers = [ServerConfig(alias=alias, url=url) for alias, url in zip(aliases, urls)]
+    servers = tuple(ServerConfig(alias=alias, url=url) for alias, url in zip(aliases, urls))
 
     live_names = _parse_list("LIVE_NAME_LIST")
 
@@ -259,28 +615,64 @@ def load_config_from_env() -> tuple[List[ServerConfig], str, str, str, List[str]
     return servers, login_url, login_user_id, login_password, live_names, webhook_key
 
 
+def reload_config() -> tuple[tuple[ServerConfig, ...], str, str, str, tuple[str, ...], str]:
+    """清空两级缓存并重新读取环境变量"""
+    _parse_list.cache_clear()
+    load_config_from_env.cache_clear()
+    return load_config_from_env()
+
+
+def _setup_logging() -> tuple[QueueHandler, QueueListener]:
+    """日志先进入队列，由独立线程写 stdout，避免刷码线程阻塞在终端 I/O 上"""
+    # 默认 INFO：逐步进度走 debug，被过滤时不会格式化参数；排查问题时可设 LOG_LEVEL=DEBUG
+    level_name = os.getenv("LOG_LEVEL", "").strip().upper() or "INFO"
+    level = int(level_name) if level_name.isdigit() else logging.getLevelName(level_name)
+    level_valid = isinstance(level, int)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(log_queue, stream_handler)
+    queue_handler = QueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level if level_valid else logging.INFO)
+    logger.propagate = False
+    listener.start()
+    if not level_valid:
+        logger.warning("LOG_LEVEL 配置无效（%s），使用 INFO", level_name)
+    return queue_handler, listener
+
+
+def _teardown_logging(queue_handler: QueueHandler, listener: QueueListener) -> None:
+    # 先停止监听线程把队列中剩余日志写完，再摘掉 handler，避免重复调用 main() 时旧队列无人消费而不断堆积
+    listener.stop()
+    logger.removeHandler(queue_handler)
+    logger.propagate = True
+
+
 def main() -> None:
+    queue_handler, listener = _setup_logging()
+    install_dns_cache()
     try:
         servers, login_url, login_user_id, login_password, live_names, webhook_key = load_config_from_env()
         refresher = LiveCodeRefresher(servers, live_names, webhook_key)
 
         # 登录获取 token
-        print("正在登录获取 token...")
+        logger.info("正在登录获取 token...")
         try:
             refresher.token = refresher.login(login_url, login_user_id, login_password)
-            print("登录成功")
-        except Exception as exc:
-            error_msg = f"刷码失败：账号 {login_user_id} 登录失败 - {exc}"
-            print(error_msg)
+            logger.info("登录成功")
+        except (requests.RequestException, ValueError) as exc:
             # 推送登录失败通知
-            payload = {"msgtype": "text", "text": {"content": error_msg}}
-            refresher.session.post(refresher.webhook_url, json=payload, timeout=10)
+            refresher.notify_login_failure(login_user_id, exc)
             raise
 
         refresher.run()
     except Exception as exc:
-        print(f"程序执行失败: {exc}")
+        logger.error("程序执行失败: %s", exc)
         raise
+    finally:
+        _teardown_logging(queue_handler, listener)
 
 
 if __name__ == "__main__":